@@ -1,6 +1,7 @@
 import numpy as np
 import tensorflow as tf
-from tensorflow.keras.layers import Layer, GRUCell, Dense, Lambda
+import warnings
+from tensorflow.keras.layers import Layer, GRUCell, Dense, StackedRNNCells
 from abc import abstractmethod
 from typing import Union
 from ..utils import Alias
@@ -23,15 +24,21 @@ class Network(Layer):
             the deep neural network. For instance, if the (global) timestep size is `1` ms, and `n_ministeps` is `5`,
             then the plant will be simulated for every `0.2` ms timesteps, with the excitatory drive from the controller
             only being updated every `1` ms.
+        jit_compile: `Boolean`, whether the simulation step performed in :meth:`call` should be compiled with XLA.
+            This fuses the network layers, the plant simulation and the feedback processing into a few kernels, but
+            requires the plant and network to only rely on operations that XLA supports.
+        noise_seed: `Integer`, the seed of the random number generator used for the feedback and hidden state noise.
+            If `None`, the generator is seeded non-deterministically.
         **kwargs: This is passed to the parent `tensorflow.keras.layers.Layer` class as-is.
     """
 
     def __init__(self, plant, proprioceptive_noise_sd: float = 0., visual_noise_sd: float = 0., n_ministeps: int = 1,
-                 **kwargs):
+                 jit_compile: bool = False, noise_seed: int = None, **kwargs):
 
         # set noise levels
         self.proprioceptive_noise_sd = proprioceptive_noise_sd
         self.visual_noise_sd = visual_noise_sd
+        self.noise_seed = noise_seed
 
         # plant states
         self.proprioceptive_delay = plant.proprioceptive_delay
@@ -75,39 +82,159 @@ class Network(Layer):
         self.do_recompute_inputs = False
         self.recompute_inputs = lambda inputs, states: inputs
 
-        # create Lambda-wrapped functions (to prevent memory leaks)
-        def get_new_proprio_feedback(mstate):
-            # normalise by muscle characteristics
-            muscle_len = tf.slice(mstate, [0, 1, 0], [-1, 1, -1]) / self.plant.muscle.l0_ce
-            muscle_vel = tf.slice(mstate, [0, 2, 0], [-1, 1, -1]) / self.plant.muscle.vmax
-            # flatten muscle length and velocity
-            proprio_true = tf.reshape(tf.concat([muscle_len, muscle_vel], axis=1), shape=(-1, self.n_muscles * 2))
-            return proprio_true
-
-        def get_new_visual_feedback(cstate):
-            visual_true, _ = tf.split(cstate, 2, axis=-1)  # position only (discard velocity)
-            return visual_true
-
-        name = "get_new_hidden_state"
-        self.get_new_hidden_state = Lambda(lambda x: [tf.zeros((x[0], n), dtype=x[1]) for n in self.n_units], name=name)
-        self.unpack_plant_states = Lambda(lambda x: x[:4], name="unpack_plant_states")
-        self.unpack_feedback_states = Lambda(lambda x: x[4:6], name="unpack_feedback_states")
-        self.get_feedback_backlog = Lambda(lambda x: tf.slice(x, [0, 0, 1], [-1, -1, -1]), name="get_feedback_backlog")
-        self.get_feedback_current = Lambda(lambda x: x[:, :, 0], name="get_feedback_current")
-        self.lambda_cat = Lambda(lambda x: tf.concat(x, axis=-1), name="lambda_cat")
-        self.lambda_cat2 = Lambda(lambda x: tf.concat(x, axis=2), name="lambda_cat2")
-        self.add_noise = Lambda(lambda x: x[0] + tf.random.normal(tf.shape(x[0]), stddev=x[1]), name="add_noise")
-        self.tile_feedback = Lambda(lambda x: tf.tile(x[0][:, :, tf.newaxis], [1, 1, x[1]]), name="tile_feedback")
-        self.get_new_proprio_feedback = Lambda(lambda x: get_new_proprio_feedback(x), name="get_new_proprio_feedback")
-        self.get_new_visual_feedback = Lambda(lambda x: get_new_visual_feedback(x), name="get_new_visual_feedback")
-        self.get_new_excitation_state = Lambda(lambda x: tf.zeros((x[0], self.plant.input_dim), dtype=x[1]))
+        # the graph function for a simulation step is created at the first call, once the structure of the inputs is
+        # known
+        self.jit_compile = jit_compile
+        self._call_fn = None
+
+        # muscle length and velocity are normalised by muscle characteristics for proprioceptive feedback
+        # (the reciprocals are stored, since multiplications are cheaper than divisions)
+        self._proprio_norm_inv = 1. / tf.concat([plant.muscle.l0_ce, plant.muscle.vmax], axis=1)
+
         self.built = False
 
-        super().__init__(**kwargs)
+        # inputs are not autocast to the compute dtype of a mixed precision policy, so that the plant and the feedback
+        # are fed full precision inputs; only the layers of the network cast to the compute dtype
+        super().__init__(autocast=False, **kwargs)
+
+        # the network owns its random number generator, so that noise draws do not depend on the global random state
+        # and the generator state is saved alongside the network weights
+        if noise_seed is None:
+            self._noise_generator = tf.random.Generator.from_non_deterministic_state()
+        else:
+            self._noise_generator = tf.random.Generator.from_seed(noise_seed)
 
     state_name = Alias("output_names", alias_name="state_name")
     """An alias name for the `output_names` attribute."""
 
+    def get_new_proprio_feedback(self, mstate):
+        """Computes the proprioceptive feedback from a `muscle state`, that is the muscle lengths and velocities,
+        respectively normalised by the optimal muscle length and maximum contraction velocity.
+
+        Args:
+            mstate: `Tensor`, the `muscle state` from which to compute the feedback.
+
+        Returns:
+            A `tensor` of dimensionality `n_batches * (n_muscles * 2)`, with all muscle lengths followed by all muscle
+            velocities.
+        """
+        return tf.reshape(mstate[:, 1:3, :] * self._proprio_norm_inv, shape=(-1, self.n_muscles * 2))
+
+    @staticmethod
+    def get_new_visual_feedback(cstate):
+        """Computes the visual feedback from a `cartesian state`, that is the cartesian position of the endpoint.
+
+        Args:
+            cstate: `Tensor`, the `cartesian state` from which to compute the feedback.
+
+        Returns:
+            A `tensor` containing the cartesian position of the endpoint.
+        """
+        visual_true, _ = tf.split(cstate, 2, axis=-1)  # position only (discard velocity)
+        return visual_true
+
+    def get_new_hidden_state(self, batch_size, dtype=tf.float32):
+        """Creates null hidden states for each layer operating on a state.
+
+        Args:
+            batch_size: `Integer`, the batch size defining the size of each state's first dimension. Passing the batch
+                size and `dtype` packed in a single `tuple` is deprecated.
+            dtype: A `dtype` from the `tensorflow.dtypes` module.
+
+        Returns:
+            A `list` of `tensor` arrays filled with zeros, one per hidden layer.
+        """
+        if isinstance(batch_size, (tuple, list)):
+            _warn_packed_arguments('get_new_hidden_state')
+            batch_size, dtype = batch_size
+        return [tf.zeros((batch_size, n), dtype=dtype) for n in self.n_units]
+
+    def get_new_excitation_state(self, batch_size, dtype=tf.float32):
+        """Creates a null excitation state.
+
+        Args:
+            batch_size: `Integer`, the batch size defining the size of the state's first dimension. Passing the batch
+                size and `dtype` packed in a single `tuple` is deprecated.
+            dtype: A `dtype` from the `tensorflow.dtypes` module.
+
+        Returns:
+            A `tensor` array filled with zeros, with as many columns as the plant has inputs.
+        """
+        if isinstance(batch_size, (tuple, list)):
+            _warn_packed_arguments('get_new_excitation_state')
+            batch_size, dtype = batch_size
+        return tf.zeros((batch_size, self.plant.input_dim), dtype=dtype)
+
+    @staticmethod
+    def get_feedback_backlog(feedback):
+        """Returns the feedback samples that are still in transit, that is all but the oldest one, which is the one
+        being fed back to the network at the current timestep.
+        """
+        return feedback[:, :, 1:]
+
+    @staticmethod
+    def tile_feedback(feedback, delay=None):
+        """Fills a feedback backlog with the same feedback sample, repeated over `delay` timesteps. Passing the
+        feedback and `delay` packed in a single `tuple` is deprecated.
+        """
+        if delay is None:
+            _warn_packed_arguments('tile_feedback')
+            feedback, delay = feedback
+        return tf.broadcast_to(feedback[:, :, tf.newaxis], tf.concat([tf.shape(feedback), [delay]], axis=0))
+
+    @staticmethod
+    def add_noise(x, noise_sd=None, seed=None):
+        """Adds gaussian noise centered on `0` and with a standard deviation `noise_sd` to `x`. If `noise_sd` is null,
+        `x` is returned as-is and no noise is drawn. If a `seed` is provided, the noise is drawn with a stateless random
+        number generator.
+
+        Args:
+            x: `Tensor`, the array to add noise to. Passing `x` and `noise_sd` packed in a single `tuple` is
+                deprecated.
+            noise_sd: `Float` or `array`, the standard deviation of the noise. If this is an `array`, it is broadcast
+                against the last dimension of `x`.
+            seed: `Tensor` of shape `(2,)` and type `int64`, the seed of the stateless draw. If `None`, the noise is
+                drawn from the global random state.
+
+        Returns:
+            A `tensor` containing the noisy version of `x`.
+        """
+        if noise_sd is None:
+            _warn_packed_arguments('add_noise')
+            x, noise_sd = x
+        if not np.any(noise_sd):
+            return x
+        if seed is None:
+            return x + tf.random.normal(tf.shape(x), dtype=x.dtype) * noise_sd
+        return x + tf.random.stateless_normal(tf.shape(x), seed=seed, dtype=x.dtype) * noise_sd
+
+    def get_new_noise_seed(self):
+        """Draws a new seed for a stateless noise draw from the network's own random number generator.
+
+        Returns:
+            A `tensor` of shape `(2,)` and type `int64`.
+        """
+        return self._noise_generator.make_seeds(1)[:, 0]
+
+    def add_noise_jointly(self, xs, noise_sds, seed=None):
+        """Adds gaussian noise to several `n_batches * n_features` arrays, using a single draw from the random number
+        generator for all of them.
+
+        Args:
+            xs: `List` of `tensor` arrays to add noise to.
+            noise_sds: `List` of `float`, the standard deviation of the noise to add to each array in `xs`.
+            seed: `Tensor` of shape `(2,)` and type `int64`, the seed of the stateless draw. If `None`, a new seed is
+                drawn from the network's random number generator.
+
+        Returns:
+            A `list` containing the noisy version of each array in `xs`.
+        """
+        sizes = [x.shape[-1] for x in xs]
+        noise_sd = np.concatenate([np.full(size, sd) for size, sd in zip(sizes, noise_sds)]).astype(np.float32)
+        if seed is None and np.any(noise_sd):
+            seed = self.get_new_noise_seed()
+        return tf.split(self.add_noise(tf.concat(xs, axis=-1), noise_sd, seed=seed), sizes, axis=-1)
+
     @abstractmethod
     def forward_pass(self, inputs, states):
         """Performs the forward pass through the network layers to obtain the motor commands that will then be passed
@@ -120,7 +247,10 @@ class Network(Layer):
         Returns:
             - A `tensor` array, the output of the last layer to use as the motor command, or excitation to the plant.
             - A `list` of the new states inherent to potential layers operating on a state.
-            - A `dictionary` of the new states inherent to potential layers operating on a state.
+
+            Subclasses may also return a `dictionary` of the new states inherent to potential layers operating on a
+            state, as a third output. These entries are then added to the output of :meth:`call` under their own
+            names.
 
         Raises:
             NotImplementedError: If this method is not overwritten by a subclass object.
@@ -134,8 +264,8 @@ class Network(Layer):
         do so in the :meth:`get_save_config` method, using this method's output `dictionary` as a base.
 
         Returns:
-             A `dictionary` containing the network's proprioceptive and visual noise standard deviation and delay, and
-             the number of muscles and ministeps.
+             A `dictionary` containing the network's proprioceptive and visual noise standard deviation and delay, the
+             number of muscles and ministeps, whether the simulation step is compiled with XLA, and the noise seed.
         """
 
         cfg = {
@@ -144,7 +274,9 @@ class Network(Layer):
             'proprioceptive_delay': self.proprioceptive_delay,
             'visual_delay': self.visual_delay,
             'n_muscle': self.n_muscles,
-            'n_ministeps': self.n_ministeps
+            'n_ministeps': self.n_ministeps,
+            'jit_compile': self.jit_compile,
+            'noise_seed': self.noise_seed,
         }
         return cfg
 
@@ -179,49 +311,75 @@ class Network(Layer):
               While this output is redundant to the user, it is necessary for `tensorflow` to process the network over
               time.
         """
+        # the network input is passed on separately from the plant keyword arguments
+        plant_kwargs = dict(inputs)
+        inputs_tensor = plant_kwargs.pop("inputs")
+
+        if self._call_fn is None:
+            # the batch size is left unspecified to avoid re-tracing if it changes
+            def get_spec(x):
+                return tf.TensorSpec([None] + x.shape[1:].as_list(), dtype=x.dtype)
+
+            input_signature = [
+                get_spec(inputs_tensor),
+                {key: get_spec(val) for key, val in plant_kwargs.items()},
+                [tf.TensorSpec([None] + shape.as_list(), dtype=self.dtype) for shape in self.state_size]]
+            self._call_fn = tf.function(self._call, input_signature=input_signature, jit_compile=self.jit_compile)
+        return self._call_fn(inputs_tensor, plant_kwargs, list(states))
+
+    def _call(self, inputs_tensor, plant_kwargs, states):
+        jstate, cstate, mstate, gstate, old_proprio_feedback, old_visual_feedback = states[:6]
 
         # handle feedback
-        old_proprio_feedback, old_visual_feedback = self.unpack_feedback_states(states)
         proprio_backlog = self.get_feedback_backlog(old_proprio_feedback)
         visual_backlog = self.get_feedback_backlog(old_visual_feedback)
-        proprio_fb = self.get_feedback_current(old_proprio_feedback)
-        visual_fb = self.get_feedback_current(old_visual_feedback)
+        proprio_fb = old_proprio_feedback[:, :, 0]  # oldest sample, which is the one fed back at this timestep
+        visual_fb = old_visual_feedback[:, :, 0]
 
         # if the task demands it, inputs will be recomputed at every timestep
+        # (`do_recompute_inputs` is a python constant, so this branch is resolved when tracing)
         if self.do_recompute_inputs:
-            inputs = self.recompute_inputs(inputs, states)
-
-        x = self.lambda_cat((proprio_fb, visual_fb, inputs.pop("inputs")))
-        u, new_network_states, new_network_states_dict = self.forward_pass(x, states)
-
-        # plant forward pass
-        jstate, cstate, mstate, gstate = self.unpack_plant_states(states)
-        for _ in range(self.n_ministeps):
-            jstate, cstate, mstate, gstate = self.plant(u, jstate, mstate, gstate, **inputs)
+            plant_kwargs = self.recompute_inputs({"inputs": inputs_tensor, **plant_kwargs}, states)
+            inputs_tensor = plant_kwargs.pop("inputs")
+
+        x = tf.concat([proprio_fb, visual_fb, inputs_tensor], axis=-1)
+        u, new_network_states, *network_states_dict = self.forward_pass(x, states)
+
+        # plant forward pass (`n_ministeps` is a python constant, so the loop form is picked when tracing)
+        if self.n_ministeps > 4:
+            # a graph loop keeps the traced graph compact when there are many ministeps
+            _, jstate, cstate, mstate, gstate = tf.while_loop(
+                cond=lambda i, *_: i < self.n_ministeps,
+                body=lambda i, j, c, m, g: (i + 1, *self.plant(u, j, m, g, **plant_kwargs)),
+                loop_vars=(tf.constant(0), jstate, cstate, mstate, gstate),
+                maximum_iterations=self.n_ministeps,  # a static trip count, so that XLA can differentiate the loop
+                parallel_iterations=1)
+        else:
+            for _ in range(self.n_ministeps):
+                jstate, cstate, mstate, gstate = self.plant(u, jstate, mstate, gstate, **plant_kwargs)
 
         proprio_true = self.get_new_proprio_feedback(mstate)
         visual_true = self.get_new_visual_feedback(cstate)
-        proprio_noisy = self.add_noise((proprio_true, self.proprioceptive_noise_sd))
-        visual_noisy = self.add_noise((visual_true, self.visual_noise_sd))
-        new_proprio_feedback = self.lambda_cat2((proprio_backlog, proprio_noisy[:, :, tf.newaxis]))
-        new_visual_feedback = self.lambda_cat2((visual_backlog, visual_noisy[:, :, tf.newaxis]))
+        proprio_noisy, visual_noisy = self.add_noise_jointly(
+            [proprio_true, visual_true], [self.proprioceptive_noise_sd, self.visual_noise_sd])
+        new_proprio_feedback = tf.concat([proprio_backlog, proprio_noisy[:, :, tf.newaxis]], axis=2)
+        new_visual_feedback = tf.concat([visual_backlog, visual_noisy[:, :, tf.newaxis]], axis=2)
 
         # pack new states
         new_states = [jstate, cstate, mstate, gstate, new_proprio_feedback, new_visual_feedback, u]
         new_states.extend(new_network_states)
 
-        # pack output
-        output = {
-            'joint position': jstate,
-            'cartesian position': cstate,
-            'muscle state': mstate,
-            'geometry state': gstate,
-            'proprioceptive feedback': new_proprio_feedback,
-            'visual feedback': new_visual_feedback,
-            'excitation': u,
-            **new_network_states_dict
-        }
-
+        # pack output, the output names follow the order of the states
+        if network_states_dict:
+            # subclasses returning a dictionary of their new states name these states themselves
+            n_base_states = len(new_states) - len(new_network_states)
+            output = {**dict(zip(self.output_names[:n_base_states], new_states)), **network_states_dict[0]}
+            return output, new_states
+        if len(self.output_names) != len(new_states):
+            raise ValueError('The network has ' + str(len(self.output_names)) + ' output names but produced ' +
+                             str(len(new_states)) + ' states. Subclasses adding states should also extend the '
+                             '`output_names` attribute accordingly.')
+        output = dict(zip(self.output_names, new_states))
         return output, new_states
 
     def get_base_initial_state(self, inputs=None, batch_size: int = 1, dtype=tf.float32):
@@ -256,14 +414,14 @@ class Network(Layer):
             states = self.plant.get_initial_state(batch_size=batch_size)
 
         # no need to add noise as this is just a placeholder for initialization purposes (i.e., not used in first pass)
-        excitation = self.get_new_excitation_state((batch_size, dtype))
+        excitation = self.get_new_excitation_state(batch_size, dtype)
 
         proprio_true = self.get_new_proprio_feedback(states[2])
         visual_true = self.get_new_visual_feedback(states[1])
-        proprio_tiled = self.tile_feedback((proprio_true, self.proprioceptive_delay))
-        visual_tiled = self.tile_feedback((visual_true, self.visual_delay))
-        proprio_noisy = self.add_noise((proprio_tiled, self.proprioceptive_noise_sd))
-        visual_noisy = self.add_noise((visual_tiled, self.visual_noise_sd))
+        proprio_tiled = self.tile_feedback(proprio_true, self.proprioceptive_delay)
+        visual_tiled = self.tile_feedback(visual_true, self.visual_delay)
+        proprio_noisy = self.add_noise(proprio_tiled, self.proprioceptive_noise_sd, seed=self.get_new_noise_seed())
+        visual_noisy = self.add_noise(visual_tiled, self.visual_noise_sd, seed=self.get_new_noise_seed())
 
         states.append(proprio_noisy)
         states.append(visual_noisy)
@@ -311,7 +469,10 @@ class GRUNetwork(Network):
             last layer of the network (`i.e.`, the output layer).
         output_kernel_initializer: A `tensorflow.keras.initializers` instance to initialize the kernels of the
             last layer of the network (`i.e.`, the output layer).
-        **kwargs: This is passed to the parent `tensorflow.keras.layers.Layer` class as-is.
+        **kwargs: This is passed to the parent `tensorflow.keras.layers.Layer` class as-is. In particular, a mixed
+            precision policy passed as `dtype` (`e.g.`, `"mixed_bfloat16"`) applies to the GRU and output layers, which
+            then compute in half precision while their weights, the hidden states and the plant remain in
+            `float32`.
     """
 
     def __init__(self, plant, n_units: Union[int, list] = 20, n_hidden_layers: int = 1, activation='tanh',
@@ -348,6 +509,7 @@ class GRUNetwork(Network):
         self.recurrent_regularizer = tf.keras.regularizers.l2(recurrent_regularizer)
         self.output_bias_initializer = output_bias_initializer
         self.output_kernel_initializer = output_kernel_initializer
+        self.stacked_hidden_layers = None
 
         if activation == 'recttanh':
             self.activation = recttanh
@@ -365,6 +527,7 @@ class GRUNetwork(Network):
                 name='hidden_layer_' + str(k),
                 kernel_regularizer=self.kernel_regularizer,
                 recurrent_regularizer=self.recurrent_regularizer,
+                dtype=self.dtype_policy,
             )
             self.layers.append(layer)
 
@@ -375,9 +538,13 @@ class GRUNetwork(Network):
             bias_initializer=self.output_bias_initializer,
             kernel_initializer=self.output_kernel_initializer,
             kernel_regularizer=self.kernel_regularizer,
+            dtype=self.dtype_policy,
         )
 
         self.layers.append(output_layer)
+
+        # the hidden layers are called as a single stacked cell
+        self.stacked_hidden_layers = StackedRNNCells(self.layers[:-1], name='hidden_layers', dtype=self.dtype_policy)
         self.built = True
 
     def get_initial_state(self, inputs=None, batch_size: int = 1, dtype=tf.float32):
@@ -397,7 +564,7 @@ class GRUNetwork(Network):
             of each GRU layer as `tensor` arrays.
         """
         states = self.get_base_initial_state(inputs=inputs, batch_size=batch_size, dtype=dtype)
-        hidden_states = self.get_new_hidden_state((batch_size, dtype))
+        hidden_states = self.get_new_hidden_state(batch_size, dtype)
         states.extend(hidden_states)
         return states
 
@@ -438,24 +605,33 @@ class GRUNetwork(Network):
         Returns:
             - A `tensor` array, the output of the last layer to use as the motor command, or excitation to the plant.
             - A `list` of the new hidden states of the GRU layers.
-            - A `dictionary` of the new hidden states of the GRU layers.
         """
-        new_hidden_states_dict = {}
-        new_hidden_states = []
-        x = inputs
+        x = tf.cast(inputs, self.compute_dtype)
 
-        for k in range(self.n_hidden_layers):
-            hidden_state_noisy = self.add_noise((states[- self.n_hidden_layers + k], self.hidden_noise_sd))
-            x, new_hidden_state = self.layers[k](x, hidden_state_noisy)
-            new_hidden_states_dict[self.layer_state_names[k]] = new_hidden_state
-            new_hidden_states.append(new_hidden_state)
-        u = self.layers[-1](x)
-        return u, new_hidden_states, new_hidden_states_dict
+        # noise is drawn in the variable dtype, and the states are only cast at the boundary of the hidden layers
+        hidden_states_noisy = self.add_noise_jointly(
+            states[- self.n_hidden_layers:], [self.hidden_noise_sd] * self.n_hidden_layers)
+        hidden_states_noisy = [tf.cast(state, self.compute_dtype) for state in hidden_states_noisy]
+        x, new_hidden_states = self.stacked_hidden_layers(x, hidden_states_noisy)
+        new_hidden_states = [tf.cast(state, self.dtype) for state in new_hidden_states]
+        u = tf.cast(self.layers[-1](x), self.dtype)
+        return u, new_hidden_states
 
 
-@tf.function
+def _warn_packed_arguments(method_name):
+    warnings.warn("Passing the arguments of `" + method_name + "` packed in a single tuple is deprecated, and will not "
+                  "be supported in future releases. Pass them as separate arguments instead.", DeprecationWarning,
+                  stacklevel=3)
+
+
+@tf.function(jit_compile=True)
+@tf.custom_gradient
 def recttanh(x):
     """A rectified hyperbolic tangent activation function."""
-    x = tf.keras.activations.tanh(x)
-    x = tf.where(tf.less_equal(x, tf.constant(0.)), tf.constant(0.), x)
-    return x
+    y = tf.nn.relu(tf.tanh(x))
+
+    def grad(upstream):
+        # the derivative of tanh is expressed from its output, which avoids recomputing tanh in the backward pass
+        return tf.where(y > 0, upstream * (1 - y * y), tf.zeros_like(y))
+
+    return y, grad
@@ -1,6 +1,5 @@
 import numpy as np
 import tensorflow as tf
-from tensorflow.keras.layers import Lambda
 from abc import abstractmethod
 
 
@@ -12,6 +11,11 @@ class Muscle:
     The dimensionality of the muscle states produced by this object and subclasses will always be
     `n_batches * n_timesteps * n_states * n_muscles`.
 
+    The batch dimension is also the environment dimension: to simulate several independent environments in parallel,
+    concatenate their states along the first axis and make a single call, rather than one call per environment. All
+    methods are vectorized across that axis, and the graph functions are traced with a variable batch size, so this
+    does not cause any re-tracing.
+
     Args:
         input_dim: `Integer`, the dimensionality of the drive input to the muscle. For instance, if the muscle is only
             driven by an excitation signal, then this value should be `1`.
@@ -25,16 +29,22 @@ class Muscle:
             Differential Equation of the muscle activation method :meth:`activation_ode`.
         tau_deactivation: `Float`, the time constant for deactivation of the muscle. This is used for the Ordinary
             Differential Equation of the muscle activation method :meth:`activation_ode`.
+        dtype: `tf.DType` or `String`, the data type in which the force curves and the `muscle state` derivatives are
+            evaluated, for instance `tf.bfloat16` to halve the memory traffic on GPU. The `muscle state` itself is
+            always accumulated in `tf.float32`, since increments of `dt * derivative` would otherwise round away, and
+            so are the muscle geometry and the initial `muscle state` inference. Inputs and outputs of the public
+            methods remain `tf.float32` regardless.
     """
 
     def __init__(self, input_dim: int = 1, output_dim: int = 1, min_activation: float = 0.,
-                 tau_activation: float = 0.015, tau_deactivation: float = 0.05):
+                 tau_activation: float = 0.015, tau_deactivation: float = 0.05, dtype=tf.float32):
         self.input_dim = input_dim
         self.state_name = []
         self.output_dim = output_dim
+        self.dtype = tf.as_dtype(dtype)
         self.min_activation = tf.constant(min_activation, name='min_activation')
-        self.tau_activation = tf.constant(tau_activation, name='tau_activation')
-        self.tau_deactivation = tf.constant(tau_deactivation, name='tau_deactivation')
+        self.tau_activation = tf.constant(tau_activation, dtype=self.dtype, name='tau_activation')
+        self.tau_deactivation = tf.constant(tau_deactivation, dtype=self.dtype, name='tau_deactivation')
         self.to_build_dict = {'max_isometric_force': []}
         self.to_build_dict_default = {}
         self.dt = None
@@ -44,11 +54,14 @@ class Muscle:
         self.l0_se = None
         self.l0_ce = None
         self.l0_pe = None
-        self._get_initial_muscle_state_fn = Lambda(lambda x: self._get_initial_muscle_state(*x), name='get_init_mstate')
-        self._activation_ode_fn = Lambda(lambda x: self._activation_ode(*x), name='activation_ode')
-        self.clip_activation = Lambda(lambda a: tf.clip_by_value(a, self.min_activation, 1.), name='clip_activation')
-        self._integrate_fn = Lambda(lambda x: self._integrate(*x), name='muscle_integrate')
-        self._update_ode_fn = Lambda(lambda x: self._update_ode(*x), name='muscle_update_ode')
+        self.params = None
+        # graph functions are compiled in `build`, once the number of muscles is known
+        self._get_initial_muscle_state_fn = None
+        self._activation_ode_fn = None
+        self._integrate_fn = None
+        self._update_ode_fn = None
+        self._step_fn = None
+        self._rollout_fn = None
         self.built = False
 
     def build(self, timestep, max_isometric_force, **kwargs):
@@ -72,8 +85,77 @@ class Muscle:
         self.l0_pe = tf.constant(tf.ones((1, 1, self.n_muscles), dtype=tf.float32), name='l0_pe')
         self.max_iso_force = tf.reshape(
             tf.constant(max_isometric_force, dtype=tf.float32, name='max_iso_force'), (1, 1, self.n_muscles))
+        self.params = tf.concat([self.max_iso_force, self.l0_se, self.l0_ce, self.l0_pe, self.vmax], axis=0)
+        self._build_functions()
         self.built = True
 
+    def clip_activation(self, activation):
+        """Clips activation values between the minimum activation value of the muscle and `1`.
+
+        Args:
+            activation: `Tensor`, the activation values to clip.
+
+        Returns:
+            A `tensor` containing the clipped activation values.
+        """
+        return tf.clip_by_value(activation, tf.cast(self.min_activation, activation.dtype), 1.)
+
+    def _build_functions(self):
+        """Compiles the numerical methods of the muscle into `tensorflow` graph functions. Input signatures are
+        declared so that each function is traced only once, regardless of the batch size. Since these signatures depend
+        on the number of muscles, this should be called at the end of the :meth:`build` method.
+
+        The integration step is compiled with XLA, which fuses its long chain of element-wise operations into a single
+        kernel. The same goes for the fused step and the rollout. The ODE functions run in the muscle's `dtype`, while
+        the integration functions accumulate the state in `tf.float32` and only evaluate the force curves in `dtype`.
+
+        To keep these graphs small, all per-muscle parameters are stacked in a single `params` tensor that the
+        functions take in as one input, and the integration steps compute each quantity with shape
+        `n_batches * n_muscles` before stacking them into a `muscle state` at the end. Piecewise terms of the force
+        curves are selected with arithmetic masks rather than `tf.where` where possible, to keep a single fused
+        multiply-add chain.
+        """
+        dt_spec = tf.TensorSpec([], dtype=tf.float32)
+        excitation_spec = tf.TensorSpec(None, dtype=tf.float32)
+        state_spec = tf.TensorSpec([None, None, self.n_muscles], dtype=tf.float32)
+        batch_size_spec = tf.TensorSpec([], dtype=tf.int32)
+
+        self._get_initial_muscle_state_fn = tf.function(
+            self._get_initial_muscle_state, input_signature=[batch_size_spec, state_spec], jit_compile=False)
+        self._activation_ode_fn = tf.function(
+            self._in_dtype(self._activation_ode), input_signature=[excitation_spec, state_spec], jit_compile=False)
+        self._integrate_fn = tf.function(
+            self._integrate, input_signature=[dt_spec, state_spec, state_spec, state_spec],
+            jit_compile=True)
+        self._update_ode_fn = tf.function(
+            self._in_dtype(self._update_ode), input_signature=[excitation_spec, state_spec], jit_compile=False)
+        self._step_fn = tf.function(
+            self._step, input_signature=[excitation_spec, state_spec, state_spec, dt_spec],
+            jit_compile=True)
+        self._rollout_fn = tf.function(
+            self._rollout,
+            input_signature=[
+                tf.TensorSpec([None, None, self.n_muscles], dtype=tf.float32),
+                tf.TensorSpec([None, None, None, self.n_muscles], dtype=tf.float32),
+                state_spec],
+            jit_compile=True)
+
+    @staticmethod
+    def _as_float32(*args):
+        """Casts the inputs of the public methods to `tf.float32`, which the input signatures of the graph functions
+        expect. This keeps accepting `float64` inputs, such as `numpy` arrays.
+        """
+        return [tf.cast(arg, tf.float32) for arg in args]
+
+    def _in_dtype(self, fn):
+        """Wraps a numerical method so that it computes in the muscle's `dtype`, while taking in and returning
+        `tf.float32` tensors.
+        """
+        def wrapped_fn(*args):
+            outputs = fn(*[tf.cast(arg, self.dtype) for arg in args])
+            return tf.nest.map_structure(lambda output: tf.cast(output, tf.float32), outputs)
+        return wrapped_fn
+
     def activation_ode(self, excitation, muscle_state):
         """Computes the new activation value of the (set of) muscle(s) according to the Ordinary Differential Equation
         shown in equations 1-2 in `[1]`.
@@ -92,7 +174,7 @@ class Muscle:
         Returns:
             A `tensor` containing the updated activation values.
         """
-        return self._activation_ode_fn((excitation, muscle_state))
+        return self._activation_ode_fn(*self._as_float32(excitation, muscle_state))
 
     def get_initial_muscle_state(self, batch_size: int, geometry_state):
         """Infers the `muscle state` matching a provided `geometry state` array.
@@ -105,7 +187,7 @@ class Muscle:
         Returns:
             A `tensor` containing the initial `muscle state` matching the input `geometry state` array.
         """
-        return self._get_initial_muscle_state_fn((batch_size, geometry_state))
+        return self._get_initial_muscle_state_fn(batch_size, *self._as_float32(geometry_state))
 
     def integrate(self, dt, state_derivative, muscle_state, geometry_state):
         """Performs one integration step for the muscle step.
@@ -120,7 +202,7 @@ class Muscle:
         Returns:
             A `tensor` containing the new `muscle state` following numerical integration.
         """
-        return self._integrate_fn((dt, state_derivative, muscle_state, geometry_state))
+        return self._integrate_fn(*self._as_float32(dt, state_derivative, muscle_state, geometry_state))
 
     def update_ode(self, excitation, muscle_state):
         """Computes the derivatives of `muscle state` using the corresponding Ordinary Differential Equations.
@@ -135,7 +217,43 @@ class Muscle:
         Returns:
             A `tensor` containing the derivatives of the `muscle state`.
         """
-        return self._update_ode_fn((excitation, muscle_state))
+        return self._update_ode_fn(*self._as_float32(excitation, muscle_state))
+
+    def step(self, excitation, muscle_state, geometry_state, dt):
+        """Performs one Euler step for the muscle(s), by evaluating the Ordinary Differential Equations and then
+        integrating over one timestep. This is equivalent to calling :meth:`update_ode` and then :meth:`integrate`, but
+        both are compiled in a single graph function, so the `muscle state` derivatives are never materialized.
+
+        Args:
+            excitation: `Float` or `list` of `float`, the descending excitation drive to the muscle(s). If several
+                muscles are declared in the parent plant object, then this should be a `list` containing as many
+                elements as there are muscles in that parent plant object.
+            muscle_state: `Tensor`, the `muscle state` used as the initial state value for the numerical integration.
+            geometry_state: `Tensor`, the `geometry state` used as the initial state value for the numerical integration.
+            dt: `Float`, size of the timestep in seconds for this integration step.
+
+        Returns:
+            A `tensor` containing the new `muscle state` following numerical integration.
+        """
+        return self._step_fn(*self._as_float32(excitation, muscle_state, geometry_state, dt))
+
+    def rollout(self, excitations, geometry_states, muscle_state):
+        """Simulates the muscle(s) over a whole trajectory of excitations and `geometry states`, given an initial
+        `muscle state`. The loop over timesteps runs within a single compiled graph function, which avoids the overhead
+        of calling :meth:`update_ode` and :meth:`integrate` once per timestep.
+
+        Args:
+            excitations: `Tensor`, the descending excitation drive to the muscle(s), with dimensionality
+                `n_batches * n_timesteps * n_muscles`.
+            geometry_states: `Tensor`, the `geometry state` at each timestep, with dimensionality
+                `n_batches * n_timesteps * n_states * n_muscles`.
+            muscle_state: `Tensor`, the `muscle state` from which the rollout starts.
+
+        Returns:
+            A `tensor` containing the `muscle state` following each timestep, with dimensionality
+            `n_batches * n_timesteps * n_states * n_muscles`.
+        """
+        return self._rollout_fn(*self._as_float32(excitations, geometry_states, muscle_state))
 
     @abstractmethod
     def _get_initial_muscle_state(self, batch_size, geometry_state):
@@ -146,8 +264,29 @@ class Muscle:
         return
 
     def _update_ode(self, excitation, muscle_state):
-        activation = tf.slice(muscle_state, [0, 0, 0], [-1, 1, -1])
-        return self.activation_ode(excitation, activation)
+        activation = muscle_state[:, :1, :]
+        return self._activation_ode(excitation, activation)
+
+    def _rollout(self, excitations, geometry_states, muscle_state):
+        n_timesteps = tf.shape(excitations)[1]
+        muscle_states = tf.TensorArray(
+            tf.float32, size=n_timesteps, dynamic_size=False, element_shape=muscle_state.shape)
+
+        def body(t, state, states):
+            state = self._step(excitations[:, t], state, geometry_states[:, t], self.dt)
+            return t + 1, state, states.write(t, state)
+
+        _, _, muscle_states = tf.while_loop(
+            cond=lambda t, *_: t < n_timesteps,
+            body=body,
+            loop_vars=(tf.constant(0), muscle_state, muscle_states),
+            maximum_iterations=n_timesteps,  # a bounded trip count, so that XLA can differentiate the loop
+            parallel_iterations=1)
+        return tf.transpose(muscle_states.stack(), (1, 0, 2, 3))
+
+    def _step(self, excitation, muscle_state, geometry_state, dt):
+        state_derivative = self._in_dtype(self._update_ode)(excitation, muscle_state)
+        return self._integrate(dt, state_derivative, muscle_state, geometry_state)
 
     def _activation_ode(self, excitation, activation):
         excitation = self.clip_activation(tf.reshape(excitation, (-1, 1, self.n_muscles)))
@@ -208,17 +347,17 @@ class ReluMuscle(Muscle):
         self.state_dim = len(self.state_name)
 
     def _integrate(self, dt, state_derivative, muscle_state, geometry_state):
-        activation = tf.slice(muscle_state, [0, 0, 0], [-1, 1, -1]) + state_derivative * dt
+        activation = muscle_state[:, :1, :] + state_derivative * dt
         activation = self.clip_activation(activation)
-        forces = tf.maximum(activation, 0.) * self.max_iso_force
-        muscle_len = tf.slice(geometry_state, [0, 0, 0], [-1, 1, -1])
-        muscle_vel = tf.slice(geometry_state, [0, 1, 0], [-1, 1, -1])
+        max_iso_force, _, _, _, _ = tf.unstack(self.params)
+        forces = tf.maximum(activation, 0.) * max_iso_force
+        muscle_len, muscle_vel = tf.split(geometry_state[:, :2, :], 2, axis=1)
         return tf.concat([activation, muscle_len, muscle_vel, forces], axis=1)
 
     def _get_initial_muscle_state(self, batch_size, geometry_state):
         excitation0 = tf.ones((batch_size, 1, self.n_muscles)) * self.min_activation
         force0 = tf.zeros((batch_size, 1, self.n_muscles))
-        len_vel = tf.slice(geometry_state, [0, 0, 0], [-1, 2, -1])
+        len_vel = geometry_state[:, :2, :]
         return tf.concat([excitation0, len_vel, force0], axis=1)
 
 
@@ -253,22 +392,33 @@ class RigidTendonHillMuscle(Muscle):
         self.state_dim = len(self.state_name)
 
         # parameters for the passive element (PE) and contractile element (CE)
-        self.pe_k = tf.constant(5., name='pe_k')
-        self.pe_1 = tf.constant(self.pe_k / 0.66, name='pe_1')
-        self.pe_den = tf.constant(tf.exp(self.pe_k) - 1, name='pe_den')
-        self.ce_gamma = tf.constant(0.45, name='ce_gamma')
+        pe_k = 5.
+        self.pe_k = tf.constant(pe_k, name='pe_k')
+        self.pe_1 = tf.constant(pe_k / 0.66, name='pe_1')
+        self.pe_den = tf.constant(np.expm1(pe_k), dtype=self.dtype, name='pe_den')
+        self.ce_gamma = tf.constant(0.45, dtype=self.dtype, name='ce_gamma')
         self.ce_Af = tf.constant(0.25, name='ce_Af')
         self.ce_fmlen = tf.constant(1.4, name='ce_fmlen')
 
         # pre-define attributes:
         self.musculotendon_slack_len = None
         self.k_pe = None
-        self.s_as = tf.constant(0.001, name='s_as')
-        self.f_iso_n_den = tf.constant(.66 ** 2, name='f_iso_n_den')
-        self.k_se = tf.constant(1 / (0.04 ** 2), name='k_se')
-        self.q_crit = tf.constant(0.3, name='q_crit')
-        self.b_rel_st_den = tf.constant(5e-3 - self.q_crit, name='b_rel_st_den')
-        self.min_flce = tf.constant(0.01, name='min_flce')
+        self.l0_ce_inv = None
+        self.l0_se_inv = None
+        self.vmax_inv = None
+        f_iso_n_den = .66 ** 2
+        q_crit = 0.3
+        self.s_as = tf.constant(0.001, dtype=self.dtype, name='s_as')
+        self.f_iso_n_den = tf.constant(f_iso_n_den, dtype=self.dtype, name='f_iso_n_den')
+        self.f_iso_n_den_inv = tf.constant(1 / f_iso_n_den, dtype=self.dtype, name='f_iso_n_den_inv')
+        self.k_se = tf.constant(1 / (0.04 ** 2), name='k_se')  # also used by the initial state inference
+        self.q_crit = tf.constant(q_crit, dtype=self.dtype, name='q_crit')
+        self.a_rel_st_max = tf.constant(.41, dtype=self.dtype, name='a_rel_st_max')
+        self.b_rel_st_max = tf.constant(5.2, dtype=self.dtype, name='b_rel_st_max')
+        self.b_rel_st_slope = tf.constant(.9, dtype=self.dtype, name='b_rel_st_slope')
+        self.b_rel_st_den = tf.constant(5e-3 - q_crit, dtype=self.dtype, name='b_rel_st_den')
+        self.b_rel_st_den_inv = tf.constant(1 / (5e-3 - q_crit), dtype=self.dtype, name='b_rel_st_den_inv')
+        self.min_flce = tf.constant(0.01, dtype=self.dtype, name='min_flce')
 
         self.to_build_dict = {'max_isometric_force': [],
                               'tendon_length': [],
@@ -315,34 +465,52 @@ class RigidTendonHillMuscle(Muscle):
         self.k_pe = tf.constant(1 / ((1.66 - self.l0_pe / self.l0_ce) ** 2), name='k_pe')
         self.musculotendon_slack_len = tf.constant(self.l0_pe + self.l0_se, name='musculotendon_slack_len')
         self.vmax = tf.constant(10 * self.l0_ce, name='vmax')
+
+        # pre-computed for speed (multiplications are cheaper than divisions)
+        self.l0_ce_inv = tf.constant(1 / self.l0_ce, name='l0_ce_inv')
+        self.l0_se_inv = tf.constant(1 / self.l0_se, name='l0_se_inv')
+        self.vmax_inv = tf.constant(1 / self.vmax, name='vmax_inv')
+
+        self.params = tf.concat(
+            [self.max_iso_force, self.l0_se, self.l0_ce, self.l0_pe, self.vmax, self.k_pe,
+             self.l0_ce_inv, self.l0_se_inv, self.vmax_inv], axis=0)
+
+        self._build_functions()
         self.built = True
 
     def _get_initial_muscle_state(self, batch_size, geometry_state):
-        musculotendon_len = tf.slice(geometry_state, [0, 0, 0], [-1, 1, -1])
+        musculotendon_len = geometry_state[:, :1, :]
         muscle_state = tf.ones_like(musculotendon_len) * self.min_activation
         return self.integrate(self.dt, tf.zeros_like(musculotendon_len), muscle_state, geometry_state)
 
     def _integrate(self, dt, state_derivative, muscle_state, geometry_state):
-        activation = self.clip_activation(tf.slice(muscle_state, [0, 0, 0], [-1, 1, -1]) + state_derivative * dt)
+        max_iso_force, l0_se, _, l0_pe, _, k_pe, l0_ce_inv, _, vmax_inv = tf.unstack(self.params)
+        activation = self.clip_activation(muscle_state[:, 0, :] + state_derivative[:, 0, :] * dt)
 
         # musculotendon geometry
-        musculotendon_len = tf.slice(geometry_state, [0, 0, 0], [-1, 1, -1])
-        muscle_vel = tf.slice(geometry_state, [0, 1, 0], [-1, 1, -1])
-        muscle_len = tf.maximum(musculotendon_len - self.l0_se, 0.)
-        muscle_strain = tf.maximum((muscle_len - self.l0_pe) / self.l0_ce, 0.)
-        muscle_len_n = muscle_len / self.l0_ce
-        muscle_vel_n = muscle_vel / self.vmax
+        musculotendon_len, muscle_vel = tf.unstack(geometry_state[:, :2, :], axis=1)
+        muscle_len = tf.maximum(musculotendon_len - l0_se, 0.)
+        muscle_strain = tf.maximum((muscle_len - l0_pe) * l0_ce_inv, 0.)
+        muscle_len_n = muscle_len * l0_ce_inv
+        muscle_vel_n = muscle_vel * vmax_inv
 
         # muscle forces
+        flpe, flce, active_force = self._in_dtype(self._force_curves)(
+            activation, muscle_strain, muscle_len_n, muscle_vel_n, k_pe)
+        force = (active_force + flpe) * max_iso_force
+        return tf.stack([activation, muscle_len, muscle_vel, flpe, flce, active_force, force], axis=1)
+
+    def _force_curves(self, activation, muscle_strain, muscle_len_n, muscle_vel_n, k_pe):
         # flpe = tf.minimum(self.k_pe * (muscle_strain ** 2), 3.)
-        flpe = self.k_pe * (muscle_strain ** 2)
-        flce = tf.maximum(1 + (- muscle_len_n ** 2 + 2 * muscle_len_n - 1) / self.f_iso_n_den, self.min_flce)
-
-        a_rel_st = tf.where(muscle_len_n > 1., .41 * flce, .41)
-        b_rel_st = tf.where(
-            condition=activation < self.q_crit,
-            x=5.2 * (1 - .9 * ((activation - self.q_crit) / (5e-3 - self.q_crit))) ** 2,
-            y=5.2)
+        flpe = k_pe * tf.square(muscle_strain)
+        flce = tf.maximum(
+            1 + (- tf.square(muscle_len_n) + 2 * muscle_len_n - 1) * self.f_iso_n_den_inv, self.min_flce)
+
+        len_mask = tf.cast(muscle_len_n > 1., dtype=self.dtype)
+        act_mask = tf.cast(activation < self.q_crit, dtype=self.dtype)
+        a_rel_st = self.a_rel_st_max * (len_mask * flce + 1. - len_mask)
+        b_rel_st_low = tf.square(1 - self.b_rel_st_slope * (activation - self.q_crit) * self.b_rel_st_den_inv)
+        b_rel_st = self.b_rel_st_max * (act_mask * b_rel_st_low + 1. - act_mask)
         dfdvcon0 = activation * (flce + a_rel_st) / b_rel_st  # inv of slope at isometric point wrt concentric curve
 
         f_x_a = flce * activation  # to speed up computation
@@ -351,18 +519,17 @@ class RigidTendonHillMuscle(Muscle):
         tmp_p_den = self.s_as - dfdvcon0 * 2.
 
         p1 = - tmp_p_nom / tmp_p_den
-        p2 = (tmp_p_nom ** 2) / tmp_p_den
+        p2 = tf.square(tmp_p_nom) / tmp_p_den
         p3 = - 1.5 * f_x_a
 
         nom = tf.where(
             condition=muscle_vel_n < 0,
             x=muscle_vel_n * activation * a_rel_st + f_x_a * b_rel_st,
-            y=-p1 * p3 + p1 * self.s_as * muscle_vel_n + p2 - p3 * muscle_vel_n + self.s_as * muscle_vel_n ** 2)
+            y=-p1 * p3 + p1 * self.s_as * muscle_vel_n + p2 - p3 * muscle_vel_n + self.s_as * tf.square(muscle_vel_n))
         den = tf.where(condition=muscle_vel_n < 0, x=b_rel_st - muscle_vel_n, y=p1 + muscle_vel_n)
 
         active_force = tf.maximum(nom / den, 0.)
-        force = (active_force + flpe) * self.max_iso_force
-        return tf.concat([activation, muscle_len, muscle_vel, flpe, flce, active_force, force], axis=1)
+        return flpe, flce, active_force
 
 
 class RigidTendonHillMuscleThelen(Muscle):
@@ -393,21 +560,25 @@ class RigidTendonHillMuscleThelen(Muscle):
         self.state_dim = len(self.state_name)
 
         # parameters for the passive element (PE) and contractile element (CE)
-        self.pe_k = tf.constant(5., name='pe_k')
-        self.pe_1 = tf.constant(self.pe_k / 0.6, name='pe_1')  # divided by epsilon_0^M in Thelen (2003) eq. 3
-        self.pe_den = tf.constant(tf.exp(self.pe_k) - 1, name='pe_den')
-        self.ce_gamma = tf.constant(0.45, name='ce_gamma')
+        pe_k = 5.
+        self.pe_k = tf.constant(pe_k, name='pe_k')
+        # divided by epsilon_0^M in Thelen (2003) eq. 3
+        self.pe_1 = tf.constant(pe_k / 0.6, name='pe_1')
+        self.pe_den = tf.constant(np.expm1(pe_k), dtype=self.dtype, name='pe_den')
+        self.ce_gamma = tf.constant(0.45, dtype=self.dtype, name='ce_gamma')
         self.ce_Af = tf.constant(0.25, name='ce_Af')
         self.ce_fmlen = tf.constant(1.4, name='ce_fmlen')
 
         # pre-define attributes:
         self.musculotendon_slack_len = None
+        self.pe_1_over_l0ce = None
         self.ce_0 = None
         self.ce_1 = None
         self.ce_2 = None
         self.ce_3 = None
         self.ce_4 = None
         self.ce_5 = None
+        self.fvce_coefficients = None
 
         self.to_build_dict = {'max_isometric_force': [],
                               'tendon_length': [],
@@ -464,36 +635,53 @@ class RigidTendonHillMuscleThelen(Muscle):
         self.ce_3 = tf.constant(8. * self.ce_Af * self.ce_fmlen + 8. * self.ce_fmlen, name='ce_3')
         self.ce_4 = tf.constant(self.ce_Af * self.ce_fmlen * self.vmax - self.ce_1, name='ce_4')
         self.ce_5 = tf.constant(8. * (self.ce_Af + 1.), name='ce_5')
-
+        self.pe_1_over_l0ce = tf.constant(self.pe_1 / self.l0_ce, name='pe_1_over_l0ce')
+
+        # the force-velocity numerator and denominator are affine functions of (activation, muscle velocity, 1), so
+        # their coefficients are held in a (n_muscles, 4, 3) matrix, with one row per term
+        ones = tf.ones_like(self.vmax)
+        fvce_coefficients = [
+            [self.ce_Af * self.ce_0, 4. * self.ce_Af * ones, self.ce_Af * self.vmax],  # numerator, muscle velocity <= 0
+            [3. * self.ce_1, -4. * ones, self.ce_1],  # denominator, muscle velocity <= 0
+            [self.ce_2, self.ce_3 * ones, self.ce_4],  # numerator, muscle velocity > 0
+            [3. * self.ce_4, self.ce_5 * ones, self.ce_4]]  # denominator, muscle velocity > 0
+        self.fvce_coefficients = tf.cast(
+            tf.stack([tf.stack(row, axis=-1) for row in fvce_coefficients], axis=-2)[0, 0], self.dtype)
+
+        self.params = tf.concat(
+            [self.max_iso_force, self.l0_se, self.l0_ce, self.l0_pe, self.vmax, self.pe_1_over_l0ce], axis=0)
+
+        self._build_functions()
         self.built = True
 
     def _get_initial_muscle_state(self, batch_size, geometry_state):
-        musculotendon_len = tf.slice(geometry_state, [0, 0, 0], [-1, 1, -1])
+        musculotendon_len = geometry_state[:, :1, :]
         muscle_state = tf.ones_like(musculotendon_len) * self.min_activation
         return self.integrate(self.dt, tf.zeros_like(musculotendon_len), muscle_state, geometry_state)
 
     def _integrate(self, dt, state_derivative, muscle_state, geometry_state):
-        activation = tf.slice(muscle_state, [0, 0, 0], [-1, 1, -1]) + state_derivative * dt
+        max_iso_force, l0_se, l0_ce, l0_pe, _, pe_1_over_l0ce = tf.unstack(self.params)
+        activation = muscle_state[:, 0, :] + state_derivative[:, 0, :] * dt
         activation = self.clip_activation(activation)
 
         # musculotendon geometry
-        musculotendon_len = tf.slice(geometry_state, [0, 0, 0], [-1, 1, -1])
-        muscle_len = tf.maximum(musculotendon_len - self.l0_se, 0.001)
-        muscle_vel = tf.slice(geometry_state, [0, 1, 0], [-1, 1, -1])
+        musculotendon_len, muscle_vel = tf.unstack(geometry_state[:, :2, :], axis=1)
+        muscle_len = tf.maximum(musculotendon_len - l0_se, 0.001)
 
         # muscle forces
-        a3 = activation * 3.
-        nom = tf.where(condition=muscle_vel <= 0,
-                       x=self.ce_Af * (activation * self.ce_0 + 4. * muscle_vel + self.vmax),
-                       y=self.ce_2 * activation + self.ce_3 * muscle_vel + self.ce_4)
-        den = tf.where(condition=muscle_vel <= 0,
-                       x=a3 * self.ce_1 + self.ce_1 - 4. * muscle_vel,
-                       y=self.ce_4 * a3 + self.ce_5 * muscle_vel + self.ce_4)
-        fvce = tf.maximum(nom / den, 0.)
-        flpe = tf.maximum((tf.exp(self.pe_1 * (muscle_len - self.l0_pe) / self.l0_ce) - 1) / self.pe_den, 0.)
-        flce = tf.exp((- ((muscle_len / self.l0_ce) - 1) ** 2) / self.ce_gamma)
-        force = (activation * flce * fvce + flpe) * self.max_iso_force
-        return tf.concat([activation, muscle_len, muscle_vel, flpe, flce, fvce, force], axis=1)
+        flpe, flce, fvce = self._in_dtype(self._force_curves)(
+            activation, muscle_vel, pe_1_over_l0ce * (muscle_len - l0_pe), muscle_len / l0_ce)
+        force = (activation * flce * fvce + flpe) * max_iso_force
+        return tf.stack([activation, muscle_len, muscle_vel, flpe, flce, fvce, force], axis=1)
+
+    def _force_curves(self, activation, muscle_vel, pe_strain, muscle_len_n):
+        fv_input = tf.stack([activation, muscle_vel, tf.ones_like(activation)], axis=-1)
+        fv_terms = tf.linalg.matvec(self.fvce_coefficients, fv_input)
+        nom_den = tf.where(tf.expand_dims(muscle_vel <= 0, axis=-1), fv_terms[..., :2], fv_terms[..., 2:])
+        fvce = tf.maximum(nom_den[..., 0] / nom_den[..., 1], 0.)
+        flpe = tf.maximum(tf.math.expm1(pe_strain) / self.pe_den, 0.)
+        flce = tf.exp((- (muscle_len_n - 1) ** 2) / self.ce_gamma)
+        return flpe, flce, fvce
 
 
 class CompliantTendonHillMuscle(RigidTendonHillMuscle):
@@ -525,49 +713,63 @@ class CompliantTendonHillMuscle(RigidTendonHillMuscle):
             'active force',
             'force']
         self.state_dim = len(self.state_name)
-        self._muscle_ode_fn = Lambda(lambda x: self._muscle_ode_lambda(*x), name='muscle_ode')
+        self._muscle_ode_fn = None
         self.built = False
 
+    def _build_functions(self):
+        super()._build_functions()
+        state_spec = tf.TensorSpec([None, 1, self.n_muscles], dtype=tf.float32)
+        self._muscle_ode_fn = tf.function(
+            self._in_dtype(self._muscle_ode_lambda), input_signature=[state_spec, state_spec, state_spec],
+            jit_compile=True)
+
     def _muscle_ode(self, muscle_len_n, activation, active_force):
-        """This wrapper allows to keep track of the argument names to be passed through the lambda function."""
-        return self._muscle_ode_fn((muscle_len_n, activation, active_force))
+        """This wrapper allows to keep track of the argument names to be passed through the graph function."""
+        return self._muscle_ode_fn(muscle_len_n, activation, active_force)
 
     def _integrate(self, dt, state_derivative, muscle_state, geometry_state):
+        max_iso_force, l0_se, l0_ce, l0_pe, vmax, k_pe, l0_ce_inv, l0_se_inv, _ = tf.unstack(self.params)
+
         # Compute musculotendon geometry
-        muscle_len = tf.slice(muscle_state, [0, 1, 0], [-1, 1, -1])
-        muscle_len_n = muscle_len / self.l0_ce
-        musculotendon_len = tf.slice(geometry_state, [0, 0, 0], [-1, 1, -1])
+        activation, muscle_len = tf.unstack(muscle_state[:, :2, :], axis=1)
+        d_activation, muscle_vel_n = tf.unstack(state_derivative[:, :2, :], axis=1)
+        muscle_len_n = muscle_len * l0_ce_inv
+        musculotendon_len = geometry_state[:, 0, :]
         tendon_len = musculotendon_len - muscle_len
-        tendon_strain = tf.maximum((tendon_len - self.l0_se) / self.l0_se, 0.)
-        muscle_strain = tf.maximum((muscle_len - self.l0_pe) / self.l0_ce, 0.)
+        tendon_strain = tf.maximum((tendon_len - l0_se) * l0_se_inv, 0.)
+        muscle_strain = tf.maximum((muscle_len - l0_pe) * l0_ce_inv, 0.)
 
         # Compute forces
-        flse = tf.minimum(self.k_se * (tendon_strain ** 2), 1.)
-        # flpe = tf.minimum(self.k_pe * (muscle_strain ** 2), 1.)
-        flpe = self.k_pe * (muscle_strain ** 2)
-        active_force = tf.maximum(flse - flpe, 0.)
+        flpe, flse, active_force = self._in_dtype(self._tendon_force_curves)(
+            tendon_strain, muscle_strain, k_pe, self.k_se)
 
         # Integrate
-        d_activation = tf.slice(state_derivative, [0, 0, 0], [-1, 1, -1])
-        muscle_vel_n = tf.slice(state_derivative, [0, 1, 0], [-1, 1, -1])
-        activation = tf.slice(muscle_state, [0, 0, 0], [-1, 1, -1]) + d_activation * dt
-        activation = self.clip_activation(activation)
-        new_muscle_len = (muscle_len_n + dt * muscle_vel_n) * self.l0_ce
+        activation = self.clip_activation(activation + d_activation * dt)
+        new_muscle_len = (muscle_len_n + dt * muscle_vel_n) * l0_ce
 
-        muscle_vel = muscle_vel_n * self.vmax
-        force = flse * self.max_iso_force
-        return tf.concat([activation, new_muscle_len, muscle_vel, flpe, flse, active_force, force], axis=1)
+        muscle_vel = muscle_vel_n * vmax
+        force = flse * max_iso_force
+        return tf.stack([activation, new_muscle_len, muscle_vel, flpe, flse, active_force, force], axis=1)
+
+    @staticmethod
+    def _tendon_force_curves(tendon_strain, muscle_strain, k_pe, k_se):
+        flse = tf.minimum(k_se * tf.square(tendon_strain), 1.)
+        # flpe = tf.minimum(self.k_pe * (muscle_strain ** 2), 1.)
+        flpe = k_pe * tf.square(muscle_strain)
+        active_force = tf.maximum(flse - flpe, 0.)
+        return flpe, flse, active_force
 
     def _update_ode(self, excitation, muscle_state):
-        activation = tf.slice(muscle_state, [0, 0, 0], [-1, 1, -1])
-        d_activation = self.activation_ode(excitation, activation)
-        muscle_len_n = tf.slice(muscle_state, [0, 1, 0], [-1, 1, -1]) / self.l0_ce
-        active_force = tf.slice(muscle_state, [0, 5, 0], [-1, 1, -1])
-        new_muscle_vel_n = self._muscle_ode(muscle_len_n, activation, active_force)
+        activation, muscle_len = tf.split(muscle_state[:, :2, :], 2, axis=1)
+        d_activation = self._activation_ode(excitation, activation)
+        *_, l0_ce_inv, _, _ = tf.unstack(tf.cast(self.params, self.dtype))
+        muscle_len_n = muscle_len * l0_ce_inv
+        active_force = muscle_state[:, 5:6, :]
+        new_muscle_vel_n = self._muscle_ode_lambda(muscle_len_n, activation, active_force)
         return tf.concat([d_activation, new_muscle_vel_n], axis=1)
 
     def _get_initial_muscle_state(self, batch_size, geometry_state):
-        musculotendon_len = tf.slice(geometry_state, [0, 0, 0], [-1, 1, -1])
+        musculotendon_len = geometry_state[:, :1, :]
         activation = tf.ones_like(musculotendon_len) * self.min_activation
 
         # if musculotendon length is negative, raise an error.
@@ -576,21 +778,18 @@ class CompliantTendonHillMuscle(RigidTendonHillMuscle):
         #   the tendon up to the tendon slack length, and the rest to the muscle length.
         # if musculotendon length is more than tendon slack length and muscle slack length combined, find the muscle
         #   length that satisfies equilibrium between tendon passive forces and muscle passive forces.
+        # All branches are computed in the graph and selected element-wise, which keeps the initial state serializable.
+        equilibrium_len = (self.k_pe * self.l0_pe * self.l0_se ** 2 -
+                           self.k_se * (self.l0_ce ** 2) * musculotendon_len +
+                           self.k_se * self.l0_ce ** 2 * self.l0_se -
+                           self.l0_ce * self.l0_se * tf.sqrt(self.k_pe * self.k_se)
+                           * (-musculotendon_len + self.l0_pe + self.l0_se)) / \
+                          (self.k_pe * self.l0_se ** 2 - self.k_se * self.l0_ce ** 2)
         muscle_len = tf.where(
-            condition=musculotendon_len < 0,
-            x=-1,
-            y=tf.where(
-                condition=musculotendon_len < self.l0_se,
-                x=0.001 * self.l0_ce,
-                y=tf.where(
-                    condition=musculotendon_len < self.l0_se + self.l0_pe,
-                    x=musculotendon_len - self.l0_se,
-                    y=(self.k_pe * self.l0_pe * self.l0_se ** 2 -
-                        self.k_se * (self.l0_ce ** 2) * musculotendon_len +
-                        self.k_se * self.l0_ce ** 2 * self.l0_se -
-                        self.l0_ce * self.l0_se * tf.sqrt(self.k_pe * self.k_se)
-                        * (-musculotendon_len + self.l0_pe + self.l0_se)) /
-                      (self.k_pe * self.l0_se ** 2 - self.k_se * self.l0_ce ** 2))))
+            musculotendon_len < 0., -1.,
+            tf.where(
+                musculotendon_len < self.l0_se, 0.001 * self.l0_ce,
+                tf.where(musculotendon_len < self.l0_se + self.l0_pe, musculotendon_len - self.l0_se, equilibrium_len)))
 
         # tf.debugging.assert_non_negative(muscle_len, message='initial muscle length was < 0.')
         tendon_len = musculotendon_len - muscle_len
@@ -609,27 +808,30 @@ class CompliantTendonHillMuscle(RigidTendonHillMuscle):
         return self.integrate(self.dt, state_derivative, muscle_state, geometry_state)
 
     def _muscle_ode_lambda(self, muscle_len_n, activation, active_force):
-        flce = tf.maximum(1. + (- muscle_len_n ** 2 + 2 * muscle_len_n - 1) / self.f_iso_n_den, self.min_flce)
-        a_rel_st = tf.where(muscle_len_n > 1., .41 * flce, .41)
-        b_rel_st = tf.where(
-            condition=activation < self.q_crit,
-            x=5.2 * (1 - .9 * ((activation - self.q_crit) / (5e-3 - self.q_crit))) ** 2,
-            y=5.2)
+        flce = tf.maximum(
+            1. + (- tf.square(muscle_len_n) + 2 * muscle_len_n - 1) * self.f_iso_n_den_inv, self.min_flce)
+        len_mask = tf.cast(muscle_len_n > 1., dtype=self.dtype)
+        act_mask = tf.cast(activation < self.q_crit, dtype=self.dtype)
+        a_rel_st = self.a_rel_st_max * (len_mask * flce + 1. - len_mask)
+        b_rel_st_low = tf.square(1 - self.b_rel_st_slope * (activation - self.q_crit) * self.b_rel_st_den_inv)
+        b_rel_st = self.b_rel_st_max * (act_mask * b_rel_st_low + 1. - act_mask)
         # inv of slope at isometric point wrt concentric curve
         f_x_a = flce * activation  # to speed up computation
         dfdvcon0 = (f_x_a + activation * a_rel_st) / b_rel_st
 
         p1 = - f_x_a * .5 / (self.s_as - dfdvcon0 * 2.)
         p3 = - 1.5 * f_x_a
-        p2_containing_term = (4 * ((f_x_a * 0.5) ** 2) * (- self.s_as)) / (self.s_as - dfdvcon0 * 2)
+        p2_containing_term = (4 * tf.square(f_x_a * 0.5) * (- self.s_as)) / (self.s_as - dfdvcon0 * 2)
 
         # defensive code to avoid propagation of negative square root in the non-selected tf.where outcome
-        # the assertion is to ensure that any selected item is indeed not a negative root.
-        sqrt_term = active_force ** 2 + 2 * active_force * p1 * self.s_as + \
-            2 * active_force * p3 + p1 ** 2 * self.s_as ** 2 + 2 * p1 * p3 * self.s_as +\
-            p2_containing_term + p3 ** 2
-        cond = tf.where(tf.logical_and(sqrt_term < 0, active_force >= f_x_a), -1, 1)
-        tf.debugging.assert_non_negative(cond, message='root that should be used is negative.')
+        # the assertion is to ensure that any selected item is indeed not a negative root. It forces a host
+        # synchronization and breaks XLA fusion, so it only runs when functions are run eagerly for debugging.
+        sqrt_term = tf.square(active_force) + 2 * active_force * p1 * self.s_as + \
+            2 * active_force * p3 + tf.square(p1 * self.s_as) + 2 * p1 * p3 * self.s_as +\
+            p2_containing_term + tf.square(p3)
+        if tf.config.functions_run_eagerly():
+            cond = tf.where(tf.logical_and(sqrt_term < 0, active_force >= f_x_a), -1, 1)
+            tf.debugging.assert_non_negative(cond, message='root that should be used is negative.')
         sqrt_term = tf.maximum(sqrt_term, 0.)
 
         new_muscle_vel_nom = tf.where(
@@ -9,6 +9,9 @@ from typing import Union
 class Plant:
     """Base class for `Plant` objects.
 
+    Independent environments are simulated in parallel by stacking them along the batch dimension of the states, which
+    is the first dimension of every state tensor. A single call then steps all environments at once.
+
     Args:
         skeleton: A :class:`motornet.plants.skeletons.Skeleton` object class or subclass. This defines the type of 
             skeleton that the muscles will wrap around.
@@ -147,8 +150,13 @@ class Plant:
             function=lambda x: tf.transpose(tf.repeat(x[0][:, :, tf.newaxis], x[1], axis=-1), [0, 2, 1]),
             name='state2target')
 
-        if self.integration_method == 'euler':
+        # the fused euler step bypasses `update_ode` and `integration_step`, so it is only used if neither is overridden
+        ode_hooks = ('update_ode', '_update_ode', 'integration_step')
+        uses_default_ode_hooks = all(getattr(type(self), hook) is getattr(Plant, hook) for hook in ode_hooks)
+        if self.integration_method == 'euler' and uses_default_ode_hooks:
             self._integrate_fn = Lambda(lambda x: self._euler(*x), name='plant_euler_integration')
+        elif self.integration_method == 'euler':
+            self._integrate_fn = Lambda(lambda x: self._euler_via_hooks(*x), name='plant_euler_integration')
         elif self.integration_method in ('rk4', 'rungekutta4', 'runge-kutta4', 'runge-kutta-4'):  # tuple faster thn set
             self._integrate_fn = Lambda(lambda x: self._rungekutta4(*x), name='plant_rk4_integration')
 
@@ -283,9 +291,14 @@ class Plant:
         return new_joint_state, new_cartesian_state, new_muscle_state, new_geometry_state
 
     def integrate(self, muscle_input, joint_state, muscle_state, geometry_state, endpoint_load, joint_load):
-        """Integrates the plant over one timestep. To do so, it first calls the :meth:`update_ode` method to obtain
-        state derivatives from evaluation of the Ordinary Differential Equations. Then it performs the numerical
-        integration over one timestep using the :meth:`integration_step` method.
+        """Integrates the plant over one timestep.
+
+        With Runge-Kutta 4 integration, this calls the :meth:`update_ode` method to obtain state derivatives from
+        evaluation of the Ordinary Differential Equations, and then performs the numerical integration using the
+        :meth:`integration_step` method, once per stage. With Euler integration, the muscles are instead advanced with
+        the fused :meth:`motornet.plants.muscles.Muscle.step` method, and the skeleton with its own `update_ode` and
+        `integrate` methods. If a subclass overrides :meth:`update_ode` or :meth:`integration_step`, Euler integration
+        falls back to calling these two methods once, so that the overrides are honoured.
 
         Args:
             muscle_input: `Tensor`, the input to the muscles (motor command). Typically, this should be the output of
@@ -302,9 +315,18 @@ class Plant:
         return self._integrate_fn((muscle_input, joint_state, muscle_state, geometry_state, endpoint_load, joint_load))
 
     def _euler(self, excitation, joint_state, muscle_state, geometry_state, endpoint_load, joint_load):
+        # the muscle ODE and integration are fused in a single muscle step, so the muscle state derivatives are
+        # never materialized
+        generalized_forces = self._get_generalized_forces(muscle_state, geometry_state, joint_load)
+        joint_derivative = self.skeleton.update_ode(generalized_forces, joint_state, endpoint_load=endpoint_load)
+        new_muscle_state = self.muscle.step(excitation, muscle_state, geometry_state, self.dt)
+        new_joint_state = self.skeleton.integrate(self.dt, joint_derivative, joint_state)
+        return new_joint_state, new_muscle_state, self.get_geometry(new_joint_state)
+
+    def _euler_via_hooks(self, excitation, joint_state, muscle_state, geometry_state, endpoint_load, joint_load):
         states0 = {"joint": joint_state, "muscle": muscle_state, "geometry": geometry_state}
-        state_derivative = self.update_ode(excitation, states0, endpoint_load, joint_load)
-        states = self.integration_step(self.dt, state_derivative=state_derivative, states=states0)
+        k = self.update_ode(excitation, states=states0, endpoint_load=endpoint_load, joint_load=joint_load)
+        states = self.integration_step(self.dt, state_derivative=k, states=states0)
         return states["joint"], states["muscle"], states["geometry"]
 
     def _rungekutta4(self, excitation, joint_state, muscle_state, geometry_state, endpoint_load, joint_load):
@@ -342,10 +364,13 @@ class Plant:
         new_states["geometry"] = self.get_geometry(new_states["joint"])
         return new_states
 
+    def _get_generalized_forces(self, muscle_state, geometry_state, joint_load):
+        moments = tf.slice(geometry_state, [0, 2, 0], [-1, -1, -1])
+        forces = tf.slice(muscle_state, [0, self.force_index, 0], [-1, 1, -1])
+        return - tf.reduce_sum(forces * moments, axis=-1) + joint_load
+
     def _update_ode(self, excitation, states, endpoint_load, joint_load):
-        moments = tf.slice(states["geometry"], [0, 2, 0], [-1, -1, -1])
-        forces = tf.slice(states["muscle"], [0, self.force_index, 0], [-1, 1, -1])
-        generalized_forces = - tf.reduce_sum(forces * moments, axis=-1) + joint_load
+        generalized_forces = self._get_generalized_forces(states["muscle"], states["geometry"], joint_load)
         state_derivative = {
             "muscle": self.muscle.update_ode(excitation, states["muscle"]),
             "joint": self.skeleton.update_ode(generalized_forces, states["joint"], endpoint_load=endpoint_load)}
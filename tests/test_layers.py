@@ -0,0 +1,71 @@
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+mn = pytest.importorskip("motornet_tf")
+
+
+def _is_finite(x):
+    return bool(tf.reduce_all(tf.math.is_finite(x)))
+
+
+def test_gradient_through_ministep_loop():
+    # more than 4 ministeps runs the plant in a graph loop, which must remain differentiable when compiled with XLA
+    batch_size, n_timesteps = 3, 4
+    plant = mn.plants.ReluPointMass24()
+    network = mn.nets.layers.GRUNetwork(plant=plant, n_units=8, n_ministeps=5, jit_compile=True)
+    rnn = tf.keras.layers.RNN(cell=network, return_sequences=True)
+    inputs = {"inputs": tf.random.normal((batch_size, n_timesteps, 2))}
+    initial_state = network.get_initial_state(batch_size=batch_size)
+
+    with tf.GradientTape() as tape:
+        outputs = rnn(inputs, initial_state=initial_state)
+        loss = tf.reduce_sum(tf.square(outputs["cartesian position"]))
+    grads = tape.gradient(loss, network.trainable_variables)
+
+    assert len(grads) > 0
+    assert all(grad is not None and _is_finite(grad) for grad in grads)
+
+
+def test_noise_is_reproducible_from_noise_seed():
+    plant = mn.plants.ReluPointMass24()
+    networks = [mn.nets.layers.GRUNetwork(plant=plant, n_units=8, noise_seed=0) for _ in range(2)]
+    xs, noise_sds = [tf.zeros((3, 8)), tf.zeros((3, 2))], [1., 0.5]
+
+    tf.random.set_seed(1)
+    noisy_a = networks[0].add_noise_jointly(xs, noise_sds)
+    tf.random.set_seed(2)  # the global random state must not affect the draws
+    noisy_b = networks[1].add_noise_jointly(xs, noise_sds)
+
+    for a, b in zip(noisy_a, noisy_b):
+        assert bool(tf.reduce_all(a == b))
+    assert not bool(tf.reduce_all(noisy_a[0] == networks[0].add_noise_jointly(xs, noise_sds)[0]))
+
+
+def test_jit_compiled_step_matches_default_step():
+    batch_size, n_timesteps = 3, 4
+    plant = mn.plants.ReluPointMass24()
+    network = mn.nets.layers.GRUNetwork(plant=plant, n_units=8)
+    rnn = tf.keras.layers.RNN(cell=network, return_sequences=True)
+    inputs = {"inputs": tf.random.normal((batch_size, n_timesteps, 2))}
+    initial_state = network.get_initial_state(batch_size=batch_size)
+    outputs = rnn(inputs, initial_state=initial_state)
+
+    network.jit_compile = True
+    network._call_fn = None  # the step is compiled again at the next call
+    outputs_jit = rnn(inputs, initial_state=initial_state)
+
+    for key, value in outputs.items():
+        assert bool(tf.reduce_all(tf.abs(value - outputs_jit[key]) < 1e-4)), key
+
+
+def test_packed_arguments_are_deprecated_but_supported():
+    plant = mn.plants.ReluPointMass24()
+    network = mn.nets.layers.GRUNetwork(plant=plant, n_units=8)
+    feedback = tf.ones((3, 2))
+
+    with pytest.warns(DeprecationWarning):
+        tiled = network.tile_feedback((feedback, 4))
+    assert tiled.shape == network.tile_feedback(feedback, 4).shape
+    with pytest.warns(DeprecationWarning):
+        excitation = network.get_new_excitation_state((3, tf.float32))
+    assert excitation.shape == (3, plant.input_dim)
@@ -0,0 +1,32 @@
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+mn = pytest.importorskip("motornet_tf")
+
+
+def test_gradient_through_rollout():
+    # the rollout loop is compiled with XLA, and must remain differentiable with respect to the excitations
+    batch_size, n_timesteps, n_muscles = 3, 10, 2
+    muscle = mn.plants.muscles.RigidTendonHillMuscle()
+    muscle.build(
+        timestep=0.01,
+        max_isometric_force=[500.] * n_muscles,
+        tendon_length=[0.1] * n_muscles,
+        optimal_muscle_length=[0.1] * n_muscles,
+        normalized_slack_muscle_length=[1.] * n_muscles)
+
+    musculotendon_len = tf.fill((batch_size, n_timesteps, 1, n_muscles), 0.2)
+    geometry_states = tf.concat(
+        [musculotendon_len, tf.zeros_like(musculotendon_len), tf.ones_like(musculotendon_len)], axis=2)
+    muscle_state = muscle.get_initial_muscle_state(batch_size, geometry_states[:, 0])
+    excitations = tf.fill((batch_size, n_timesteps, n_muscles), 0.5)
+
+    with tf.GradientTape() as tape:
+        tape.watch(excitations)
+        muscle_states = muscle.rollout(excitations, geometry_states, muscle_state)
+        loss = tf.reduce_sum(muscle_states[:, :, -1])  # force
+    grad = tape.gradient(loss, excitations)
+
+    assert muscle_states.shape == (batch_size, n_timesteps, muscle.state_dim, n_muscles)
+    assert grad is not None
+    assert bool(tf.reduce_all(tf.math.is_finite(grad)))
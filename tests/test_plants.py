@@ -0,0 +1,22 @@
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+mn = pytest.importorskip("motornet_tf")
+
+
+def test_euler_integration_honours_overridden_update_ode():
+    # the fused euler step is only used if the ODE hooks are not overridden
+    calls = []
+
+    class TracedPointMass(mn.plants.ReluPointMass24):
+        def update_ode(self, excitation, states, endpoint_load, joint_load):
+            calls.append(1)
+            return super().update_ode(excitation, states, endpoint_load, joint_load)
+
+    batch_size = 2
+    for plant, n_calls in [(mn.plants.ReluPointMass24(), 0), (TracedPointMass(), 1)]:
+        calls.clear()
+        joint_state, _, muscle_state, geometry_state = plant.get_initial_state(batch_size=batch_size)
+        excitation = tf.fill((batch_size, plant.input_dim), 0.5)
+        plant(excitation, joint_state, muscle_state, geometry_state)
+        assert len(calls) == n_calls